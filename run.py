@@ -1,12 +1,15 @@
 import json
 import logging
+import mmap
 import os
 import re
 import traceback
-from typing import Any, Dict, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import IO, Any, Dict, List, Optional, Sequence, Set, Tuple
 import yaml
 
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from functools import cached_property, lru_cache
 from getpass import getuser
 from pathlib import Path
 from rich.logging import RichHandler
@@ -24,7 +27,24 @@ from sweagent import (
 from swebench import KEY_INSTANCE_ID, KEY_MODEL, KEY_PREDICTION
 from unidiff import PatchSet
 
-from sweagent.environment.utils import InvalidGithubURL, get_associated_commit_urls, get_gh_issue_data, parse_gh_issue_url
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:  # libyaml is not available
+    from yaml import SafeDumper, SafeLoader
+
+try:
+    import orjson
+except ImportError:  # optional speedup, see the `fast` extra in setup.py
+    orjson = None
+
+from sweagent.environment.utils import (
+    InvalidGithubURL,
+    get_associated_commit_urls,
+    get_gh_issue_data,
+    get_github_token,
+    get_instances,
+    parse_gh_issue_url,
+)
 
 handler = RichHandler(show_time=False, show_path=False)
 handler.setLevel(logging.DEBUG)
@@ -66,10 +86,36 @@ class ScriptArguments(FlattenedAccess, FrozenSerializable):
     suffix: str = ""
     # Raise unhandled exceptions during the run (useful for debugging)
     raise_exceptions: bool = False
+    # Number of task instances to run in parallel. Every worker uses its own container
+    # and model, and gets an equal share of `total_cost_limit`.
+    num_workers: int = 1
+
+    def __post_init__(self):
+        if self.num_workers < 1:
+            raise ValueError("`num_workers` must be at least 1.")
+        if self.num_workers > 1 and self.environment.container_name is not None:
+            raise ValueError(
+                "Running multiple workers with a persistent container (`container_name`) "
+                "is not supported, because all workers would share the same container."
+            )
 
-    @property
-    def run_name(self):
-        """Generate a unique name for this run based on the arguments."""
+    @cached_property
+    def yaml_dump(self) -> str:
+        """The arguments serialized as yaml. Cached, because the instance is frozen."""
+        return self.dumps_yaml(Dumper=SafeDumper)
+
+    @cached_property
+    def instance_filter_regex(self) -> Optional[re.Pattern]:
+        """Compiled `instance_filter`, or None if it matches every instance."""
+        if self.instance_filter == ".*":
+            return None
+        return re.compile(self.instance_filter)
+
+    @cached_property
+    def run_name(self) -> str:
+        """Generate a unique name for this run based on the arguments.
+        Cached, because the instance is frozen.
+        """
         model_name = self.agent.model.model_name.replace(":", "-")
         data_stem = get_data_path_name(self.environment.data_path)
         config_stem = Path(self.agent.config_file).stem
@@ -88,76 +134,315 @@ class ScriptArguments(FlattenedAccess, FrozenSerializable):
 
 
 def main(args: ScriptArguments):
-    logger.info(f"📙 Arguments: {args.dumps_yaml()}")
-    agent = Agent("primary", args.agent)
-
-    env = SWEEnv(args.environment)
+    logger.info("📙 Arguments: %s", args.yaml_dump)
+    if args.num_workers == 1:
+        agent = Agent("primary", args.agent)
+        env = SWEEnv(args.environment)
+        data = env.data
+    else:
+        # Every worker process sets up its own agent and environment
+        data = get_instances(
+            args.environment.data_path, args.environment.base_commit, args.environment.split, token=get_github_token()
+        )
 
-    traj_dir = Path("trajectories") / Path(getuser()) / args.run_name
+    traj_dir = Path("trajectories", getuser(), args.run_name)
     traj_dir.mkdir(parents=True, exist_ok=True)
+    (traj_dir / "patches").mkdir(exist_ok=True)
 
     save_arguments(traj_dir, args)
 
-    for index in range(len(env.data)):
-        try:
-            # Reset environment
-            instance_id = env.data[index]["instance_id"]
+    with os.scandir(traj_dir) as entries:
+        existing_trajs = {entry.name for entry in entries if entry.name.endswith(".traj")}
+
+    with (traj_dir / "all_preds.jsonl").open("a", encoding="utf-8") as preds_fp:
+        if args.num_workers > 1:
+            run_parallel(args, data, traj_dir, existing_trajs, preds_fp)
+            return
+        for index in range(len(data)):
+            instance_id = data[index]["instance_id"]
             assert isinstance(instance_id, str)  # mypy
-            if should_skip(args, traj_dir, instance_id):
-                continue
-            logger.info("▶️  Beginning task " + str(index))
-
-            observation, info = env.reset(index)
-            if info is None:
-                continue
-
-            # Get info, patch information
-            issue = getattr(env, "query", None)
-            files = []
-            if "patch" in env.record:
-                files = "\n".join(
-                    [f"- {x.path}" for x in PatchSet(env.record["patch"]).modified_files]
-                )
-            # Get test files, F2P tests information
-            test_files = []
-            if "test_patch" in env.record:
-                test_patch_obj = PatchSet(env.record["test_patch"])
-                test_files = "\n".join(
-                    [f"- {x.path}" for x in test_patch_obj.modified_files + test_patch_obj.added_files]
-                )
-            tests = ""
-            if "FAIL_TO_PASS" in env.record:
-                tests = "\n".join([f"- {x}" for x in env.record["FAIL_TO_PASS"]])
-
-            setup_args = {
-                "issue": issue,
-                "files": files,
-                "test_files": test_files,
-                "tests": tests
-            }
-            info, trajectory = agent.run(
-                setup_args=setup_args,
-                env=env,
-                observation=observation,
-                traj_dir=traj_dir,
-                return_type="info_trajectory",
-            )
-            save_predictions(traj_dir, instance_id, info)
-            save_patch(traj_dir, instance_id, info)
-            if args.actions.open_pr and should_open_pr(args, info, token=env._github_token):
-                env.open_pr(trajectory=trajectory, push_gh_repo_url=args.actions.push_gh_repo_url)
+            try:
+                if _should_skip_instance(args, traj_dir, instance_id, existing_trajs):
+                    continue
+                # Errors of the run itself are handled by `run_one`
+                info = run_one(args, agent, env, index, instance_id, traj_dir)
+                _save_instance_result(args, traj_dir, instance_id, info, preds_fp)
+            except KeyboardInterrupt:
+                logger.info("Exiting InterCode environment...")
+                env.close()
+                break
+
+
+_DIFF_GIT_PATTERN = re.compile(r"^diff --git (.+)$", re.MULTILINE)
+_TARGET_FILE_PATTERN = re.compile(r"^\+\+\+ ([^\t\n]+)", re.MULTILINE)
+_RENAME_TO_PATTERN = re.compile(r"^rename to (.+)$", re.MULTILINE)
+
+
+def _strip_diff_prefix(path: str) -> str:
+    """Remove the a/ or b/ prefix of a (possibly quoted) path from a diff header."""
+    quoted = path.startswith('"') and path.endswith('"')
+    if quoted:
+        path = path[1:-1]
+    if path.startswith(("a/", "b/")):
+        path = path[2:]
+    return f'"{path}"' if quoted else path
+
+
+def _get_target_path(diff_git_args: str, header: str) -> str:
+    """Return the path of a changed file after the change, as reported by `unidiff`."""
+    match = _TARGET_FILE_PATTERN.search(header)
+    if match:
+        return _strip_diff_prefix(match.group(1))
+    match = _RENAME_TO_PATTERN.search(header)
+    if match:
+        return match.group(1)
+    # No ---/+++ lines (binary files, mode changes): the header is "a/<path> b/<path>"
+    if diff_git_args.endswith('"'):
+        return _strip_diff_prefix(diff_git_args[diff_git_args.rindex(' "') + 1:])
+    if (len(diff_git_args) - 1) % 2 == 0:
+        half = (len(diff_git_args) - 1) // 2
+        if diff_git_args[:half][2:] == diff_git_args[half + 1:][2:]:
+            return _strip_diff_prefix(diff_git_args[half + 1:])
+    _, _, target = diff_git_args.rpartition(" b/")
+    return target or diff_git_args
+
+
+def get_changed_files(patch: str) -> Tuple[List[str], List[str]]:
+    """Return the paths of the modified and of the added files of a diff.
+
+    For git diffs, only the file headers are inspected, which is much cheaper than
+    parsing the full diff with `unidiff.PatchSet`, but the paths are the same as those of
+    `PatchSet.modified_files` and `PatchSet.added_files`. Other unified diffs (without
+    `diff --git` lines) are parsed with `PatchSet`. Removed files are not included.
+    """
+    matches = list(_DIFF_GIT_PATTERN.finditer(patch))
+    if not matches and ("\n+++ " in patch or patch.startswith("--- ")):
+        patch_set = PatchSet(patch)
+        return [x.path for x in patch_set.modified_files], [x.path for x in patch_set.added_files]
+    modified, added = [], []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(patch)
+        hunk_start = patch.find("\n@@", match.end(), end)
+        header = patch[match.end():hunk_start if hunk_start != -1 else end]
+        if "\ndeleted file mode" in header or "\n+++ /dev/null" in header:
+            continue
+        path = _get_target_path(match.group(1), header)
+        if "\nnew file mode" in header or "\n--- /dev/null" in header:
+            added.append(path)
+        else:
+            modified.append(path)
+    return modified, added
+
+
+def _format_list(items: Sequence[str]) -> str:
+    """Format items as a markdown list with one item per line."""
+    return "- " + "\n- ".join(items) if items else ""
+
+
+def run_one(
+    args: ScriptArguments, agent: Agent, env: SWEEnv, index: int, instance_id: str, traj_dir: Path
+) -> Optional[Dict[str, Any]]:
+    """Run the agent on a single task instance.
+    Errors are logged (and re-raised if `args.raise_exceptions` is set).
+
+    Returns:
+        The info dictionary of the agent run, or None if the instance could not be run.
+    """
+    logger.info("▶️  Beginning task %d", index)
+    info = None
+    try:
+        # Reset environment
+        observation, reset_info = env.reset(index)
+        if reset_info is None:
+            return None
+
+        # Get info, patch information (skipping fields that the agent's templates do not use)
+        record = env.record
+        used_fields = agent.config.instance_template_fields
+        issue = getattr(env, "query", None)
+        files = []
+        patch = record.get("patch")
+        if patch is not None and "files" in used_fields:
+            modified_files, _ = get_changed_files(patch)
+            files = _format_list(modified_files)
+        # Get test files, F2P tests information
+        test_files = []
+        test_patch = record.get("test_patch")
+        if test_patch is not None and "test_files" in used_fields:
+            modified_files, added_files = get_changed_files(test_patch)
+            test_files = _format_list(modified_files + added_files)
+        tests = ""
+        fail_to_pass = record.get("FAIL_TO_PASS")
+        if fail_to_pass is not None and "tests" in used_fields:
+            tests = _format_list(fail_to_pass)
+
+        setup_args = {
+            "issue": issue,
+            "files": files,
+            "test_files": test_files,
+            "tests": tests
+        }
+        info, trajectory = agent.run(
+            setup_args=setup_args,
+            env=env,
+            observation=observation,
+            traj_dir=traj_dir,
+            return_type="info_trajectory",
+        )
+        if args.actions.open_pr and should_open_pr(args, info, token=env._github_token):
+            env.open_pr(trajectory=trajectory, push_gh_repo_url=args.actions.push_gh_repo_url)
+    except KeyboardInterrupt:
+        raise
+    except Exception as e:
+        _handle_instance_error(args, instance_id, e)
+        env.reset_container()
+    return info
+
+
+def _handle_instance_error(args: ScriptArguments, instance_id: str, e: Exception) -> None:
+    """Log an exception raised while handling an instance. Re-raise it if `args.raise_exceptions` is set."""
+    traceback.print_exc()
+    logger.warning("❌ Failed on %s: %s", instance_id, e)
+    if args.raise_exceptions:
+        raise e
+
+
+def _should_skip_instance(args: ScriptArguments, traj_dir: Path, instance_id: str, existing_trajs: Set[str]) -> bool:
+    """Like `should_skip`, but errors are handled like other instance errors and the instance is skipped."""
+    try:
+        return should_skip(args, traj_dir, instance_id, existing_trajs)
+    except Exception as e:
+        _handle_instance_error(args, instance_id, e)
+        return True
+
+
+def _save_instance_result(
+    args: ScriptArguments, traj_dir: Path, instance_id: str, info: Optional[Dict[str, Any]], preds_fp: IO[str]
+) -> None:
+    """Save the result of an instance (if it was run), handling errors like other instance errors."""
+    if info is None:
+        return
+    try:
+        save_result(traj_dir, instance_id, info, preds_fp)
+    except Exception as e:
+        _handle_instance_error(args, instance_id, e)
+
+
+# Agent and environment of a worker process of `run_parallel`
+_worker: Dict[str, Any] = {}
+
+
+def _get_worker_agent_args(args: ScriptArguments) -> AgentArguments:
+    """Agent arguments of a worker process. The models of the workers do not share their costs,
+    so the total cost limit is split between them.
+    """
+    model = args.agent.model
+    if model.total_cost_limit <= 0:
+        return args.agent
+    model = replace(model, total_cost_limit=model.total_cost_limit / args.num_workers)
+    return replace(args.agent, model=model)
+
+
+def _init_worker(args: ScriptArguments) -> None:
+    _worker["args"] = args
+    _worker["agent"] = Agent("primary", _get_worker_agent_args(args))
+    _worker["env"] = SWEEnv(args.environment)
 
+
+def _run_one_in_worker(index: int, instance_id: str, traj_dir: Path) -> Optional[Dict[str, Any]]:
+    try:
+        return run_one(_worker["args"], _worker["agent"], _worker["env"], index, instance_id, traj_dir)
+    except KeyboardInterrupt:
+        _worker["env"].close()
+        raise
+
+
+def run_parallel(args: ScriptArguments, data, traj_dir: Path, existing_trajs: Set[str], preds_fp: IO[str]) -> None:
+    """Run the task instances in `args.num_workers` processes, each with its own agent and container.
+    Predictions and patches are saved by the calling process as the instances finish.
+    """
+    with ProcessPoolExecutor(
+        max_workers=args.num_workers, initializer=_init_worker, initargs=(args,)
+    ) as executor:
+        futures = {}
+        try:
+            for index in range(len(data)):
+                instance_id = data[index]["instance_id"]
+                assert isinstance(instance_id, str)  # mypy
+                if _should_skip_instance(args, traj_dir, instance_id, existing_trajs):
+                    continue
+                futures[executor.submit(_run_one_in_worker, index, instance_id, traj_dir)] = instance_id
+            for future in as_completed(futures):
+                instance_id = futures.pop(future)
+                _save_instance_result(args, traj_dir, instance_id, future.result(), preds_fp)
         except KeyboardInterrupt:
             logger.info("Exiting InterCode environment...")
-            env.close()
-            break
-        except Exception as e:
-            traceback.print_exc()
-            logger.warning(f"❌ Failed on {env.record['instance_id']}: {e}")
-            if args.raise_exceptions:
-                raise e
-            env.reset_container()
-            continue
+            try:
+                # Instances that finished but were not returned by `as_completed` yet already have
+                # complete trajectories, so they would be skipped (and never saved) on the next run
+                for future, instance_id in futures.items():
+                    if future.done() and not future.cancelled() and future.exception() is None:
+                        _save_instance_result(args, traj_dir, instance_id, future.result(), preds_fp)
+            finally:
+                executor.shutdown(cancel_futures=True)
+        except Exception:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+def _json_dumps(obj: Any) -> str:
+    """Serialize `obj` to a compact json string, using orjson if available.
+    Both code paths produce the same output (non-ascii characters are not escaped).
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def _json_loads(data: bytes) -> Any:
+    """Deserialize json data, using orjson if available."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter than the json module, e.g., it rejects NaN
+            pass
+    return json.loads(data)
+
+
+# `Agent.save_trajectory` writes "info" as the last top-level key with indent=2.
+# Raw newlines cannot occur inside json strings, so this marker is unambiguous.
+_TRAJ_INFO_MARKER = b'\n  "info": '
+
+
+def _load_traj_info(log_path: Path) -> Dict[str, Any]:
+    """Return the "info" entry of a trajectory file without parsing the full history."""
+    with log_path.open("rb") as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = mm.rfind(_TRAJ_INFO_MARKER)
+                tail = mm[start + len(_TRAJ_INFO_MARKER):].rstrip() if start != -1 else b""
+        except ValueError:  # empty file
+            tail = b""
+        if tail.endswith(b"}"):
+            try:
+                # Drop the closing brace of the top-level object
+                return _json_loads(tail[:-1])
+            except ValueError:
+                pass
+        f.seek(0)
+        return _json_loads(f.read())["info"]
+
+
+def _write_file(path: Path, content: str) -> None:
+    """Write `content` to `path` as utf-8 with a single open/write/close."""
+    data = memoryview(content.encode("utf-8"))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
 
 
 def should_open_pr(args: ScriptArguments, info: Dict[str, Any], *, token: str="") -> bool:
@@ -174,7 +459,7 @@ def should_open_pr(args: ScriptArguments, info: Dict[str, Any], *, token: str=""
         logger.info("Currently only github is supported to open PRs to. Skipping PR creation.")
         return False
     if issue.state != "open":
-        logger.info(f"Issue is not open (state={issue.state}. Skipping PR creation.")
+        logger.info("Issue is not open (state=%s). Skipping PR creation.", issue.state)
         return False
     if issue.locked:
         logger.info("Issue is locked. Skipping PR creation.")
@@ -184,13 +469,14 @@ def should_open_pr(args: ScriptArguments, info: Dict[str, Any], *, token: str=""
     if associated_commits:
         commit_url_strs = ", ".join(associated_commits)
         if args.actions.skip_if_commits_reference_issue:
-            logger.info(f"Issue already has associated commits (see {commit_url_strs}). Skipping PR creation.")
+            logger.info("Issue already has associated commits (see %s). Skipping PR creation.", commit_url_strs)
             return False
         else:
             logger.warning(
                 "Proceeding with PR creation even though there are already commits "
-                f"({commit_url_strs}) associated with the issue. Please only do this for your own repositories "
-                "or after verifying that the existing commits do not fix the issue."
+                "(%s) associated with the issue. Please only do this for your own repositories "
+                "or after verifying that the existing commits do not fix the issue.",
+                commit_url_strs,
             )
     return True
 
@@ -201,23 +487,33 @@ def save_arguments(traj_dir: Path, args: ScriptArguments) -> None:
 
     if log_path.exists():
         try:
-            other_args = args.load_yaml(log_path)
-            if (args.dumps_yaml() != other_args.dumps_yaml()):  # check yaml equality instead of object equality
+            # Resumed runs usually have an identical file, in which case there is nothing to do
+            if log_path.read_text(encoding="utf-8") == args.yaml_dump:
+                return
+            other_args = args.load_yaml(log_path, load_fn=yaml.load, Loader=SafeLoader)
+            if (args.yaml_dump != other_args.yaml_dump):  # check yaml equality instead of object equality
                 logger.warning("**************************************************")
                 logger.warning("Found existing args.yaml with different arguments!")
                 logger.warning("**************************************************")
         except Exception as e:
-            logger.warning(f"Failed to load existing args.yaml: {e}")
+            logger.warning("Failed to load existing args.yaml: %s", e)
 
-    with log_path.open("w") as f:
-        args.dump_yaml(f)
+    # Write to a temporary file first so that an interrupted run never leaves a truncated args.yaml
+    tmp_path = log_path.with_suffix(".yaml.tmp")
+    _write_file(tmp_path, args.yaml_dump)
+    os.replace(tmp_path, log_path)
 
 
-def should_skip(args: ScriptArguments, traj_dir: Path, instance_id: str) -> bool:
-    """Check if we should skip this instance based on the instance filter and skip_existing flag."""
+def should_skip(args: ScriptArguments, traj_dir: Path, instance_id: str, existing_trajs: Set[str]) -> bool:
+    """Check if we should skip this instance based on the instance filter and skip_existing flag.
+
+    Args:
+        existing_trajs: Names of the trajectory files in `traj_dir` at the start of the run.
+    """
     # Skip instances that don't match the instance filter
-    if re.match(args.instance_filter, instance_id) is None:
-        logger.info(f"Instance filter not matched. Skipping instance {instance_id}")
+    instance_filter_regex = args.instance_filter_regex
+    if instance_filter_regex is not None and instance_filter_regex.match(instance_id) is None:
+        logger.info("Instance filter not matched. Skipping instance %s", instance_id)
         return True
 
     # If flag is set to False, don't skip
@@ -225,51 +521,62 @@ def should_skip(args: ScriptArguments, traj_dir: Path, instance_id: str) -> bool
         return False
 
     # Check if there's an existing trajectory for this instance
-    log_path = traj_dir / (instance_id + ".traj")
-    if log_path.exists():
-        with log_path.open("r") as f:
-            data = json.load(f)
+    log_name = instance_id + ".traj"
+    if log_name in existing_trajs:
+        log_path = traj_dir / log_name
+        try:
+            exit_status = _load_traj_info(log_path).get("exit_status", None)
+        except (ValueError, KeyError):
+            # E.g., the trajectory was only partially written when the run was interrupted
+            logger.warning("Failed to parse existing trajectory: %s", log_path)
+            exit_status = None
         # If the trajectory has no exit status, it's incomplete and we will redo it
-        exit_status = data["info"].get("exit_status", None)
         if exit_status == "early_exit" or exit_status is None:
-            logger.info(f"Found existing trajectory with no exit status: {log_path}")
+            logger.info("Found existing trajectory with no exit status: %s", log_path)
             logger.info("Removing incomplete trajectory...")
             os.remove(log_path)
         else:
-            logger.info(f"⏭️ Skipping existing trajectory: {log_path}")
+            logger.info("⏭️ Skipping existing trajectory: %s", log_path)
             return True
     return False
 
 
-def save_predictions(traj_dir: Path, instance_id: str, info):
-    output_file = traj_dir / "all_preds.jsonl"
-    model_patch = info["submission"] if "submission" in info else None
-    datum = {
-        KEY_MODEL: Path(traj_dir).name,
-        KEY_INSTANCE_ID: instance_id,
-        KEY_PREDICTION: model_patch,
-    }
-    with open(output_file, "a+") as fp:
-        print(json.dumps(datum), file=fp, flush=True)
-    logger.info(f"Saved predictions to {output_file}")
+def save_result(traj_dir: Path, instance_id: str, info: Dict[str, Any], preds_fp: IO[str]) -> None:
+    """Save the prediction and, if there is a submission, the patch file of a finished instance."""
+    model_patch = info.get("submission")
+    save_predictions(traj_dir.name, instance_id, model_patch, preds_fp)
+    if model_patch is None:
+        logger.info("No patch to save.")
+        return
+    save_patch(traj_dir / "patches" / f"{instance_id}.patch", model_patch)
+
+
+@lru_cache(maxsize=None)
+def _predictions_prefix(run_name: str) -> str:
+    """The serialized fields of a prediction that are the same for the whole run."""
+    return f'{{"{KEY_MODEL}":{_json_dumps(run_name)},"{KEY_INSTANCE_ID}":'
 
 
-def save_patch(traj_dir: Path, instance_id: str, info) -> Optional[Path]:
+def save_predictions(run_name: str, instance_id: str, model_patch: Optional[str], preds_fp: IO[str]):
+    # Equivalent to dumping {KEY_MODEL: ..., KEY_INSTANCE_ID: ..., KEY_PREDICTION: ...},
+    # but only the values that change between instances go through the json encoder
+    preds_fp.write(
+        f'{_predictions_prefix(run_name)}{_json_dumps(instance_id)},'
+        f'"{KEY_PREDICTION}":{_json_dumps(model_patch)}}}\n'
+    )
+    # Flush right away: a killed run must not lose predictions of instances whose
+    # trajectories are complete, because those instances are skipped on resume
+    preds_fp.flush()
+    logger.info("Saved predictions to %s", preds_fp.name)
+
+
+def save_patch(patch_output_file: Path, model_patch: str) -> None:
     """Create patch files that can be applied with `git am`.
-    
-    Returns:
-        The path to the patch file, if it was saved. Otherwise, returns None.
+
+    The `patches` directory is created by `main` before the first call.
     """
-    patch_output_dir = traj_dir / "patches"
-    patch_output_dir.mkdir(exist_ok=True, parents=True)
-    patch_output_file = patch_output_dir / f"{instance_id}.patch"
-    if not "submission" in info:
-        logger.info("No patch to save.")
-        return
-    model_patch = info["submission"]
-    patch_output_file.write_text(model_patch)
-    logger.info(f"Saved patch to {patch_output_file}")
-    return patch_output_file
+    _write_file(patch_output_file, model_patch)
+    logger.info("Saved patch to %s", patch_output_file)
 
 
 def get_args(args=None) -> ScriptArguments:
@@ -310,7 +617,7 @@ def get_args(args=None) -> ScriptArguments:
             return dumper.represent_scalar("tag:yaml.org,2002:str", data, style="|")
         return dumper.represent_scalar("tag:yaml.org,2002:str", data)
 
-    yaml.add_representer(str, multiline_representer)
+    yaml.add_representer(str, multiline_representer, Dumper=SafeDumper)
 
     return parse(ScriptArguments, default=defaults, add_config_path_arg=False, args=args)
 
@@ -44,5 +44,8 @@ setuptools.setup(
         'together',
         'unidiff',
     ],
+    extras_require={
+        'fast': ['orjson'],
+    },
     include_package_data=True,
 )
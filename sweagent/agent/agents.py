@@ -1,6 +1,7 @@
 import json
 import re
 import logging
+import string
 
 from dataclasses import dataclass
 from pathlib import Path
@@ -20,7 +21,7 @@ from sweagent.agent.parsing import ParseFunction, FormatError
 from sweagent.environment.utils import LOGGER_NAME
 from sweagent.environment.swe_env import SWEEnv
 from tenacity import RetryError
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, List, Optional, Set, Tuple, Any
 
 logger = logging.getLogger(LOGGER_NAME)
 
@@ -39,6 +40,18 @@ class Subroutine(FrozenSerializable):
     agent_args: Optional[Any] = None
 
 
+def _get_template_fields(*templates: Optional[str]) -> Set[str]:
+    """Return the names of the fields referenced by the given format strings."""
+    names = set()
+    for template in templates:
+        if template is None:
+            continue
+        for _, field_name, _, _ in string.Formatter().parse(template):
+            if field_name:
+                names.add(re.split(r"[.\[]", field_name, maxsplit=1)[0])
+    return names
+
+
 @dataclass(frozen=True)
 class AgentConfig(FrozenSerializable):
     system_template: str
@@ -175,6 +188,17 @@ class AgentConfig(FrozenSerializable):
             "history_processor",
             HistoryProcessor.get(self.history_processor, **self.history_processor_args),
         )
+        # Instance arguments that are actually used by the templates
+        object.__setattr__(
+            self,
+            "instance_template_fields",
+            _get_template_fields(
+                self.instance_template,
+                self.next_step_template,
+                self.next_step_no_output_template,
+                self.strategy_template,
+            ),
+        )
 
 
 @dataclass(frozen=True)
@@ -1,6 +1,5 @@
 from pathlib import Path
 import random
-import config
 import datetime
 import docker
 import gymnasium as gym
@@ -23,6 +22,7 @@ from sweagent.environment.utils import (
     format_trajectory_markdown,
     get_container,
     get_gh_issue_data,
+    get_github_token,
     get_instances,
     is_from_github_url,
     parse_gh_issue_url,
@@ -98,12 +98,7 @@ class SWEEnv(gym.Env):
         except:
             logger.warning("Failed to get commit hash for this repo")
 
-        self._github_token = os.environ.get("GITHUB_TOKEN", None)
-        if not self._github_token and os.path.isfile(
-            os.path.join(os.getcwd(), "keys.cfg")
-        ):
-            cfg = config.Config(os.path.join(os.getcwd(), "keys.cfg"))
-            self._github_token = cfg.get("GITHUB_TOKEN", None)
+        self._github_token = get_github_token()
 
         # Load Task Instances
         self.data_path = self.args.data_path
@@ -1,4 +1,5 @@
 import shlex
+import config
 import docker
 import json
 import logging
@@ -13,11 +14,12 @@ import time
 import traceback
 
 from datasets import load_dataset, load_from_disk
+from functools import lru_cache
 from ghapi.all import GhApi
 from io import BytesIO
 from pathlib import Path
 from subprocess import PIPE, STDOUT
-from typing import List, Set, Tuple, Dict
+from typing import List, Optional, Set, Tuple, Dict
 
 LOGGER_NAME = "intercode"
 START_UP_DELAY = 5
@@ -337,16 +339,26 @@ def parse_gh_repo_url(repo_url: str) -> Tuple[str, str]:
     return owner, repo
 
 
+@lru_cache(maxsize=1024)
 def get_gh_issue_data(issue_url: str, *, token: str = ""):
     """Returns github issue data in the form of a dictionary.
     See https://docs.github.com/en/rest/issues/issues?apiVersion=2022-11-28#get-an-issue
-    for return format
+    for return format. Results are cached for the lifetime of the process.
     """
     owner, repo, issue_number = parse_gh_issue_url(issue_url)
     api = GhApi(token=token)
     return api.issues.get(owner, repo, issue_number)
 
 
+def get_github_token() -> Optional[str]:
+    """Return the GitHub token from the environment or from keys.cfg in the working directory."""
+    token = os.environ.get("GITHUB_TOKEN", None)
+    if not token and os.path.isfile(os.path.join(os.getcwd(), "keys.cfg")):
+        cfg = config.Config(os.path.join(os.getcwd(), "keys.cfg"))
+        token = cfg.get("GITHUB_TOKEN", None)
+    return token
+
+
 def get_instances(file_path: str, base_commit: str = None, split: str = None, token: str = None):
     """
     Getter function for handling json, jsonl files
@@ -401,8 +413,11 @@ def get_instances(file_path: str, base_commit: str = None, split: str = None, to
         )
 
 
+@lru_cache(maxsize=1024)
 def get_associated_commit_urls(org: str, repo: str, issue_number: str, *, token: str = "") -> list[str]:
-    """Return the URLs of commits that would close an issue."""
+    """Return the URLs of commits that would close an issue.
+    Results are cached for the lifetime of the process.
+    """
     api = GhApi(token=token)
     # Strangely the "pull_request" field of api.issues.get is often not set
     # so we have to go through the events to check if there's a commit
@@ -0,0 +1,20 @@
+from sweagent.agent.agents import AgentConfig, _get_template_fields
+
+
+def test_get_template_fields():
+    assert _get_template_fields("{issue}\n{files}") == {"issue", "files"}
+    assert _get_template_fields("{issue.title} {x[0]} {tests!r:>10}") == {"issue", "x", "tests"}
+    assert _get_template_fields(None, "{observation}", None) == {"observation"}
+    assert _get_template_fields("{{files}} {{{issue}}}") == {"issue"}
+    assert _get_template_fields() == set()
+
+
+def test_agent_config_instance_template_fields():
+    config = AgentConfig(
+        system_template="{command_docs}",
+        instance_template="{issue.title}\n{files}",
+        next_step_template="{{test_files}} {observation}",
+        next_step_no_output_template=None,
+    )
+    # The system template is formatted with the config, not the instance arguments
+    assert config.instance_template_fields == {"issue", "files", "observation"}
@@ -1,4 +1,9 @@
+import getpass
+import json
+import math
+import pytest
 import subprocess
+from functools import partial
 
 def test_run_cli_help():
     args = [
@@ -6,4 +11,371 @@ def test_run_cli_help():
         "run.py",
         "--help",
     ]
-    subprocess.run(args, check=True)
\ No newline at end of file
+    subprocess.run(args, check=True)
+
+
+def test_should_skip_instance_filter(tmp_path):
+    from run import get_args, should_skip
+    args = get_args(["--instance_filter", "astropy__.*"])
+    assert should_skip(args, tmp_path, "django__django-1234", set())
+    assert not should_skip(args, tmp_path, "astropy__astropy-1234", set())
+
+
+def test_save_predictions(tmp_path):
+    from run import save_predictions
+    with (tmp_path / "all_preds.jsonl").open("a") as preds_fp:
+        save_predictions("run_name", "instance-1", "diff", preds_fp)
+        save_predictions("run_name", "instance-2", None, preds_fp)
+    lines = (tmp_path / "all_preds.jsonl").read_text().splitlines()
+    preds = [json.loads(line) for line in lines]
+    assert lines == [json.dumps(pred, separators=(",", ":")) for pred in preds]
+    assert preds == [
+        {"model_name_or_path": "run_name", "instance_id": "instance-1", "model_patch": "diff"},
+        {"model_name_or_path": "run_name", "instance_id": "instance-2", "model_patch": None},
+    ]
+
+
+def test_should_skip_existing_trajectory(tmp_path):
+    from run import get_args, should_skip
+    args = get_args([])
+    info = {"exit_status": "submitted", "submission": '\n  "info": {"exit_status": null}\n'}
+    traj = {"environment": "swe_main", "trajectory": [], "history": [{"info": {}}], "info": info}
+    (tmp_path / "done.traj").write_text(json.dumps(traj, indent=2))
+    assert should_skip(args, tmp_path, "done", {"done.traj", "early.traj"})
+    traj["info"] = {"exit_status": "early_exit"}
+    (tmp_path / "early.traj").write_text(json.dumps(traj))
+    assert not should_skip(args, tmp_path, "early", {"done.traj", "early.traj"})
+    assert not (tmp_path / "early.traj").exists()
+
+
+def test_num_workers_validation():
+    from run import get_args
+    with pytest.raises(ValueError):
+        get_args(["--num_workers", "0"])
+    with pytest.raises(ValueError):
+        get_args(["--num_workers", "2", "--container_name", "my-container"])
+
+
+def test_worker_cost_limit():
+    from run import _get_worker_agent_args, get_args
+    args = get_args(["--num_workers", "4", "--total_cost_limit", "10"])
+    agent_args = _get_worker_agent_args(args)
+    assert agent_args.model.total_cost_limit == 2.5
+    assert agent_args.model.per_instance_cost_limit == args.agent.model.per_instance_cost_limit
+    assert agent_args.config == args.agent.config
+    assert args.agent.model.total_cost_limit == 10
+    # No limit
+    args = get_args(["--num_workers", "4"])
+    assert _get_worker_agent_args(args).model.total_cost_limit == 0
+
+
+def test_get_changed_files():
+    from unidiff import PatchSet
+    from run import get_changed_files
+    patch = "\n".join([
+        "diff --git a/src/mod.py b/src/mod.py",
+        "index 1234567..89abcde 100644",
+        "--- a/src/mod.py",
+        "+++ b/src/mod.py",
+        "@@ -1,2 +1,2 @@",
+        " a",
+        "-b",
+        "+c",
+        "diff --git a/tests/test_new.py b/tests/test_new.py",
+        "new file mode 100644",
+        "index 0000000..1234567",
+        "--- /dev/null",
+        "+++ b/tests/test_new.py",
+        "@@ -0,0 +1 @@",
+        "+diff --git a/not/a/file b/not/a/file",
+        "diff --git a/old.py b/old.py",
+        "deleted file mode 100644",
+        "index 1234567..0000000",
+        "--- a/old.py",
+        "+++ /dev/null",
+        "@@ -1 +0,0 @@",
+        "-x",
+        "diff --git a/my file.py b/my file.py",
+        "index 7898192..9ad2ebb 100644",
+        "--- a/my file.py\t",
+        "+++ b/my file.py\t",
+        "@@ -1 +1,2 @@",
+        " a",
+        "+a2",
+        "diff --git a/new file.py b/new file.py",
+        "new file mode 100644",
+        "index 0000000..8ba3a16",
+        "--- /dev/null",
+        "+++ b/new file.py\t",
+        "@@ -0,0 +1 @@",
+        "+n",
+        'diff --git "a/d\\303\\251l.py" "b/d\\303\\251l.py"',
+        "index d905d9d..b5a09e9 100644",
+        '--- "a/d\\303\\251l.py"',
+        '+++ "b/d\\303\\251l.py"',
+        "@@ -1 +1,2 @@",
+        " e",
+        "+e2",
+        "diff --git a/bin.dat b/bin.dat",
+        "index bdc955b..8835708 100644",
+        "Binary files a/bin.dat and b/bin.dat differ",
+        "diff --git a/mode.sh b/mode.sh",
+        "old mode 100644",
+        "new mode 100755",
+        "diff --git a/old name.py b/new name.py",
+        "similarity index 100%",
+        "rename from old name.py",
+        "rename to new name.py",
+        "",
+    ])
+    patch_set = PatchSet(patch)
+    modified, added = get_changed_files(patch)
+    assert modified == [x.path for x in patch_set.modified_files] == [
+        "src/mod.py", "my file.py", '"d\\303\\251l.py"', "bin.dat", "mode.sh", "new name.py"
+    ]
+    assert added == [x.path for x in patch_set.added_files] == ["tests/test_new.py", "new file.py"]
+
+
+def test_should_skip_truncated_trajectory(tmp_path):
+    from run import get_args, should_skip
+    args = get_args([])
+    traj = {"environment": "swe_main", "trajectory": [], "history": [], "info": {"exit_status": "submitted"}}
+    content = json.dumps(traj, indent=2)
+    (tmp_path / "truncated.traj").write_text(content[: len(content) // 2])
+    assert not should_skip(args, tmp_path, "truncated", {"truncated.traj"})
+    assert not (tmp_path / "truncated.traj").exists()
+
+
+def test_get_changed_files_plain_diff():
+    from run import get_changed_files
+    from unidiff import PatchSet
+    patch = "\n".join([
+        "--- /dev/null\t2024-01-01 00:00:00.000000000 +0000",
+        "+++ src/m.py\t2024-01-01 00:00:00.000000000 +0000",
+        "@@ -0,0 +1 @@",
+        "+x = 1",
+        "--- src/old.py.orig\t2024-01-01 00:00:00.000000000 +0000",
+        "+++ src/old.py\t2024-01-01 00:00:00.000000000 +0000",
+        "@@ -1 +1 @@",
+        "-y = 1",
+        "+y = 2",
+        "",
+    ])
+    patch_set = PatchSet(patch)
+    modified, added = get_changed_files(patch)
+    assert modified == [x.path for x in patch_set.modified_files] == ["src/old.py"]
+    assert added == [x.path for x in patch_set.added_files] == ["src/m.py"]
+    assert get_changed_files("") == ([], [])
+
+
+def test_save_result(tmp_path):
+    from run import save_result
+    traj_dir = tmp_path / "run_name"
+    (traj_dir / "patches").mkdir(parents=True)
+    with (traj_dir / "all_preds.jsonl").open("a") as preds_fp:
+        save_result(traj_dir, "instance-1", {}, preds_fp)
+        save_result(traj_dir, "instance-2", {"submission": "diff ü\n"}, preds_fp)
+    assert [p.name for p in (traj_dir / "patches").iterdir()] == ["instance-2.patch"]
+    assert (traj_dir / "patches" / "instance-2.patch").read_text(encoding="utf-8") == "diff ü\n"
+    assert len((traj_dir / "all_preds.jsonl").read_text().splitlines()) == 2
+
+
+def test_save_arguments(tmp_path, caplog, monkeypatch):
+    from run import get_args, logger, save_arguments
+    monkeypatch.setattr(logger, "handlers", [caplog.handler])
+    args = get_args([])
+    save_arguments(tmp_path, args)
+    assert (tmp_path / "args.yaml").read_text() == args.yaml_dump
+    save_arguments(tmp_path, args)
+    assert "different arguments" not in caplog.text
+    save_arguments(tmp_path, get_args(["--suffix", "other"]))
+    assert "different arguments" in caplog.text
+
+
+def test_json_helpers():
+    import run
+    datum = {"patch": "ü\n", "stats": None}
+    assert run._json_dumps(datum) == json.dumps(datum, separators=(",", ":"), ensure_ascii=False)
+    assert math.isnan(run._json_loads(b'{"cost": NaN}')["cost"])
+
+
+_INSTANCES = [{"instance_id": f"instance-{i}"} for i in range(4)]
+
+
+class _FakeEnv:
+    _github_token = None
+
+    def __init__(self, args):
+        self.data = _INSTANCES
+
+    def reset(self, index):
+        self.record = dict(self.data[index])
+        return "observation", {}
+
+    def close(self):
+        pass
+
+    def reset_container(self):
+        pass
+
+
+class _FakeAgent:
+    # Instance ids for which `run` raises the given exception
+    raises: dict = {}
+
+    def __init__(self, name, args):
+        self.config = type("FakeConfig", (), {"instance_template_fields": {"issue"}})()
+
+    def run(self, setup_args, env, observation, traj_dir, return_type):
+        instance_id = env.record["instance_id"]
+        if instance_id in self.raises:
+            raise self.raises[instance_id]
+        info = {"exit_status": "submitted", "submission": f"diff {instance_id}\n"}
+        (traj_dir / f"{instance_id}.traj").write_text(json.dumps({"info": info}, indent=2))
+        return info, []
+
+
+@pytest.fixture
+def fake_run(tmp_path, monkeypatch):
+    """Patch `run` to use fake agents/environments and return a function that runs `main`."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import run
+    monkeypatch.setattr(run, "Agent", _FakeAgent)
+    monkeypatch.setattr(run, "SWEEnv", _FakeEnv)
+    monkeypatch.setattr(run, "get_instances", lambda *args, **kwargs: _INSTANCES)
+    # Workers inherit the patched module only when forked
+    monkeypatch.setattr(
+        run, "ProcessPoolExecutor", partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context("fork"))
+    )
+    monkeypatch.setattr(_FakeAgent, "raises", {})
+
+    def _run(cli_args):
+        args = run.get_args(cli_args)
+        monkeypatch.chdir(tmp_path)
+        run.main(args)
+        traj_dir = next((tmp_path / "trajectories").glob("*/*"))
+        preds = [json.loads(line) for line in (traj_dir / "all_preds.jsonl").read_text().splitlines()]
+        patches = sorted(p.name for p in (traj_dir / "patches").iterdir())
+        return traj_dir, preds, patches
+
+    return _run
+
+
+@pytest.mark.parametrize("num_workers", ["1", "2"])
+def test_main(fake_run, num_workers):
+    traj_dir, preds, patches = fake_run(["--num_workers", num_workers])
+    assert sorted(pred["instance_id"] for pred in preds) == [x["instance_id"] for x in _INSTANCES]
+    assert all(pred["model_name_or_path"] == traj_dir.name for pred in preds)
+    assert patches == [f"{x['instance_id']}.patch" for x in _INSTANCES]
+
+
+@pytest.mark.parametrize("num_workers", ["1", "2"])
+def test_main_skips_existing(fake_run, tmp_path, num_workers):
+    import run
+    args = run.get_args(["--num_workers", num_workers])
+    traj_dir = tmp_path / "trajectories" / getpass.getuser() / args.run_name
+    traj_dir.mkdir(parents=True)
+    (traj_dir / "instance-0.traj").write_text(json.dumps({"info": {"exit_status": "submitted"}}, indent=2))
+    # Left behind by an interrupted run
+    (traj_dir / "instance-1.traj").write_text('{\n  "info": {"exit_st')
+    _, preds, patches = fake_run(["--num_workers", num_workers])
+    assert sorted(pred["instance_id"] for pred in preds) == ["instance-1", "instance-2", "instance-3"]
+    assert patches == ["instance-1.patch", "instance-2.patch", "instance-3.patch"]
+
+
+@pytest.mark.parametrize("num_workers", ["1", "2"])
+def test_main_failed_instance(fake_run, num_workers):
+    _FakeAgent.raises = {"instance-2": RuntimeError("boom")}
+    _, preds, _ = fake_run(["--num_workers", num_workers])
+    assert sorted(pred["instance_id"] for pred in preds) == ["instance-0", "instance-1", "instance-3"]
+
+
+@pytest.mark.parametrize("num_workers", ["1", "2"])
+def test_main_raise_exceptions(fake_run, capfd, num_workers):
+    _FakeAgent.raises = {"instance-2": RuntimeError("boom")}
+    with pytest.raises(RuntimeError, match="boom"):
+        fake_run(["--num_workers", num_workers, "--raise_exceptions", "True"])
+    # The error is reported once
+    out, err = capfd.readouterr()
+    assert (out + err).count("Failed on instance-2") == 1
+
+
+@pytest.mark.parametrize("num_workers", ["1", "2"])
+def test_main_keyboard_interrupt(fake_run, num_workers):
+    _FakeAgent.raises = {"instance-0": KeyboardInterrupt()}
+    _, preds, _ = fake_run(["--num_workers", num_workers])
+    assert "instance-0" not in {pred["instance_id"] for pred in preds}
+
+
+def test_main_keyboard_interrupt_saves_finished(fake_run, monkeypatch):
+    from concurrent.futures import wait
+    import run
+
+    def interrupted_first(futures):
+        # All other instances finish before the interrupt is seen
+        wait(futures)
+        yield from sorted(futures, key=lambda future: future.exception() is None)
+
+    monkeypatch.setattr(run, "as_completed", interrupted_first)
+    _FakeAgent.raises = {"instance-1": KeyboardInterrupt()}
+    _, preds, patches = fake_run(["--num_workers", "2"])
+    assert sorted(pred["instance_id"] for pred in preds) == ["instance-0", "instance-2", "instance-3"]
+    assert patches == ["instance-0.patch", "instance-2.patch", "instance-3.patch"]
+
+
+@pytest.mark.parametrize("num_workers", ["1", "2"])
+def test_main_save_failure(fake_run, monkeypatch, num_workers):
+    import run
+    save_patch = run.save_patch
+
+    def flaky_save_patch(patch_output_file, model_patch):
+        if patch_output_file.name == "instance-1.patch":
+            raise OSError("disk full")
+        save_patch(patch_output_file, model_patch)
+
+    monkeypatch.setattr(run, "save_patch", flaky_save_patch)
+    _, _, patches = fake_run(["--num_workers", num_workers])
+    assert patches == ["instance-0.patch", "instance-2.patch", "instance-3.patch"]
+
+
+def test_run_one_setup_args(tmp_path):
+    from run import get_args, run_one
+    seen = {}
+
+    class Env(_FakeEnv):
+        query = "issue"
+
+        def __init__(self):
+            patch = "diff --git a/src/mod.py b/src/mod.py\n--- a/src/mod.py\n+++ b/src/mod.py\n@@ -1 +1 @@\n-x\n+y\n"
+            self.data = [{"instance_id": "instance-0", "patch": patch, "test_patch": patch, "FAIL_TO_PASS": ["test_a"]}]
+
+    class Agent(_FakeAgent):
+        def __init__(self, instance_template_fields):
+            self.config = type("FakeConfig", (), {"instance_template_fields": instance_template_fields})()
+
+        def run(self, setup_args, **kwargs):
+            seen.update(setup_args)
+            return super().run(setup_args, **kwargs)
+
+    args = get_args([])
+    run_one(args, Agent({"issue", "files"}), Env(), 0, "instance-0", tmp_path)
+    assert seen == {"issue": "issue", "files": "- src/mod.py", "test_files": [], "tests": ""}
+    seen.clear()
+    run_one(args, Agent({"issue", "test_files", "tests"}), Env(), 0, "instance-0", tmp_path)
+    assert seen == {"issue": "issue", "files": [], "test_files": "- src/mod.py", "tests": "- test_a"}
+
+
+def test_run_one_reset_failure(tmp_path):
+    from run import get_args, run_one
+    reset_containers = []
+
+    class Env(_FakeEnv):
+        def reset(self, index):
+            raise RuntimeError("no container")
+
+        def reset_container(self):
+            reset_containers.append(True)
+
+    assert run_one(get_args([]), _FakeAgent("primary", None), Env(None), 0, "instance-0", tmp_path) is None
+    assert reset_containers == [True]
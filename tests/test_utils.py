@@ -38,4 +38,24 @@ def test_get_associated_commit_urls():
         repo="SWE-agent",
         issue_number="41"
     )
-    assert len(assoc) > 0
\ No newline at end of file
+    assert len(assoc) > 0
+
+
+def test_get_gh_issue_data_is_cached(monkeypatch):
+    import sweagent.environment.utils as utils
+    calls = []
+
+    class FakeGhApi:
+        def __init__(self, token):
+            self.issues = self
+
+        def get(self, owner, repo, issue_number):
+            calls.append((owner, repo, issue_number))
+            return {"state": "open"}
+
+    monkeypatch.setattr(utils, "GhApi", FakeGhApi)
+    utils.get_gh_issue_data.cache_clear()
+    url = "https://github.com/princeton-nlp/SWE-agent/issues/43"
+    assert utils.get_gh_issue_data(url) == utils.get_gh_issue_data(url) == {"state": "open"}
+    assert calls == [("princeton-nlp", "SWE-agent", "43")]
+    utils.get_gh_issue_data.cache_clear()